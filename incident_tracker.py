@@ -3,19 +3,85 @@ Incident Tracker API with SQLite + SQLAlchemy
 Take Home Assignment - Penguin Randomhouse
 """
 
-from datetime import datetime, timezone
+import threading
+import time
 from enum import Enum
 
-from flask import Flask, jsonify, request
+import click
+import orjson
+import sqlalchemy as sa
+from flask import Flask, Response, jsonify, request
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
 
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that serializes with orjson instead of the stdlib json module"""
+
+    def _option(self, indent=False):
+        option = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumpb(self, obj, indent=False):
+        """Serialize obj straight to bytes"""
+        return orjson.dumps(obj, default=self.default, option=self._option(indent))
+
+    def dumps(self, obj, **kwargs):
+        return self.dumpb(obj, indent=bool(kwargs.get("indent"))).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self.dumpb(obj, indent), mimetype=self.mimetype)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+app.json.sort_keys = False
+app.json.compact = True
 
 # Database config
 app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///site.db"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# site.db is file-backed, so it gets a QueuePool. An in-memory URI would get a
+# StaticPool, which rejects pool_size/max_overflow; drop them if switching.
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+    "pool_size": 10,
+    "max_overflow": 20,
+    "pool_pre_ping": False,
+    "pool_recycle": -1,
+    "connect_args": {"check_same_thread": False, "timeout": 30},
+}
 db = SQLAlchemy(app)
 
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA foreign_keys=ON",
+)
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply WAL and cache tuning to every new SQLite connection"""
+    cursor = dbapi_connection.cursor()
+    for pragma in SQLITE_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+with app.app_context():
+    sa.event.listen(db.engine, "connect", set_sqlite_pragmas)
+
 
 class Severity(Enum):
     """Enums for incident severity levels"""
@@ -33,29 +99,138 @@ class Status(Enum):
     RESOLVED = "Resolved"
 
 
+VALID_SEVERITY = frozenset(severity.value for severity in Severity)
+VALID_STATUS = frozenset(status.value for status in Status)
+SEVERITY_MESSAGE = f"Severity must be {[severity.value for severity in Severity]}"
+STATUS_MESSAGE = f"Status must be {[status.value for status in Status]}"
+
+ROW_KEYS = (
+    "id",
+    "title",
+    "description",
+    "reported_by",
+    "severity",
+    "timestamp",
+    "status",
+)
+
+MAX_PAGE_SIZE = 200
+MAX_SQLITE_INTEGER = 2**63 - 1
+MAX_BATCH_SIZE = 500
+FETCH_BATCH_SIZE = 50
+
+# Serialized GET /incidents bodies, keyed by (generation, filters, page).
+# Writes bump the generation so stale entries can never be hit again; the
+# TTL bounds staleness from writes made by other processes.
+RESPONSE_CACHE_TTL = 2.0
+RESPONSE_CACHE_MAX_ENTRIES = 256
+_response_cache = {}
+_cache_generation = 0
+_cache_lock = threading.Lock()
+
+
+def invalidate_response_cache():
+    """Forget every cached GET /incidents response"""
+    global _cache_generation
+    with _cache_lock:
+        _cache_generation += 1
+        _response_cache.clear()
+
+
+# Opening bytes of a GET /incidents body, by whether ?compact was requested
+LISTING_PREFIX = b'{"incidents":['
+COMPACT_LISTING_PREFIX = b'{"columns":' + orjson.dumps(ROW_KEYS) + b',"incidents":['
+
+# Static error bodies, serialized once at import
+ERR_NO_JSON = orjson.dumps({"error": "No JSON data provided"})
+ERR_NOT_FOUND = orjson.dumps({"error": "Incident not found"})
+ERR_NOT_AN_OBJECT = orjson.dumps({"error": "Expected a JSON object"})
+ERR_NOT_A_BATCH = orjson.dumps({"error": "Expected a JSON array of incidents"})
+ERR_BATCH_TOO_LARGE = orjson.dumps(
+    {
+        "error": "Batch too large",
+        "message": f"A batch may contain at most {MAX_BATCH_SIZE} incidents",
+    }
+)
+ERR_INVALID_SEVERITY = orjson.dumps(
+    {"error": "Invalid severity", "message": SEVERITY_MESSAGE}
+)
+ERR_INVALID_STATUS = orjson.dumps(
+    {"error": "Invalid status", "message": STATUS_MESSAGE}
+)
+
+
+def error_response(body, status):
+    """Wrap a pre-serialized JSON error body in a response"""
+    return Response(body, status=status, mimetype="application/json")
+
+
+# Stored codes are part of the on-disk format: never renumber an existing
+# member, only give new members unused codes
+SEVERITY_CODES = {Severity.LOW: 0, Severity.MEDIUM: 1, Severity.HIGH: 2}
+STATUS_CODES = {Status.OPEN: 0, Status.IN_PROGRESS: 1, Status.RESOLVED: 2}
+
+
+class EnumCode(sa.types.TypeDecorator):
+    """Store an Enum's string values as small integer codes"""
+
+    impl = sa.SmallInteger
+    cache_ok = True
+
+    def __init__(self, codes):
+        super().__init__()
+        enum_cls = type(next(iter(codes)))
+        if set(codes) != set(enum_cls) or len(set(codes.values())) != len(codes):
+            raise ValueError(
+                f"codes must map every {enum_cls.__name__} member to a unique code"
+            )
+        # Kept as a tuple so the type stays hashable for statement caching
+        self.codes = tuple((member.value, code) for member, code in codes.items())
+        self._codes = dict(self.codes)
+        self._values = {code: value for value, code in self.codes}
+
+    def process_bind_param(self, value, dialect):
+        # Unknown names bind as NULL so filters on them match nothing
+        if value is None:
+            return None
+        return self._codes.get(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        try:
+            return self._values[value]
+        except KeyError:
+            raise LookupError(
+                f"Unrecognized stored code {value!r}; databases created before "
+                "severity/status were stored as integers must be recreated "
+                "(see README)"
+            ) from None
+
+
 class Incident(db.Model):
     """Incident database model"""
 
     __tablename__ = "incidents"
+    __table_args__ = (
+        db.Index("idx_incidents_status_sev_ts", "status", "severity", "timestamp"),
+        db.Index("idx_incidents_timestamp", "timestamp"),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=False)
     reported_by = db.Column(db.String(100), nullable=False)
-    severity = db.Column(db.String(20), nullable=False)
-    status = db.Column(db.String(20), nullable=False, default="Open")
+    severity = db.Column(EnumCode(SEVERITY_CODES), nullable=False, index=True)
+    status = db.Column(
+        EnumCode(STATUS_CODES), nullable=False, default=Status.OPEN.value, index=True
+    )
     timestamp = db.Column(
-        db.DateTime(timezone=True), nullable=False, default=datetime.now(timezone.utc)
+        db.DateTime(timezone=True),
+        nullable=False,
+        server_default=sa.func.current_timestamp(),
     )
 
-    def __init__(self, title, description, reported_by, severity):
-        self.title = title
-        self.description = description
-        self.reported_by = reported_by
-        self.severity = severity
-        self.status = Status.OPEN.value
-        self.timestamp = datetime.now(timezone.utc)
-
     def to_dict(self):
         """Convert incident to dictionary for JSON serialization"""
         return {
@@ -64,35 +239,69 @@ class Incident(db.Model):
             "description": self.description,
             "reported_by": self.reported_by,
             "severity": self.severity,
-            "timestamp": self.timestamp.isoformat(),
+            "timestamp": self.timestamp,
             "status": self.status,
         }
 
 
-def validate_fields(data):
-    """Check to see that all fields required to create an incident exist"""
-    if not data:
-        return jsonify({"error": "No JSON data provided"}), 400
+# Same order as ROW_KEYS
+INCIDENT_COLUMNS = (
+    Incident.id,
+    Incident.title,
+    Incident.description,
+    Incident.reported_by,
+    Incident.severity,
+    Incident.timestamp,
+    Incident.status,
+)
+
+
+def listing_statements(*filters):
+    """Build the page and count statements for one combination of filters"""
+    page = (
+        sa.select(*INCIDENT_COLUMNS)
+        .where(*filters)
+        # CURRENT_TIMESTAMP has one-second resolution, so break ties on id
+        .order_by(Incident.timestamp.desc(), Incident.id.desc())
+        .limit(sa.bindparam("limit"))
+        .offset(sa.bindparam("offset"))
+    )
+    count = sa.select(sa.func.count()).select_from(Incident).where(*filters)
+    return page, count
+
 
-    missing = [
+# Built once at import; get_incidents only binds parameters
+LIST_ALL = listing_statements()
+LIST_BY_STATUS = listing_statements(Incident.status == sa.bindparam("status"))
+LIST_BY_SEVERITY = listing_statements(Incident.severity == sa.bindparam("severity"))
+LIST_BY_BOTH = listing_statements(
+    Incident.status == sa.bindparam("status"),
+    Incident.severity == sa.bindparam("severity"),
+)
+# Indexed by (bool(status) << 1) | bool(severity)
+LISTINGS = (LIST_ALL, LIST_BY_SEVERITY, LIST_BY_STATUS, LIST_BY_BOTH)
+
+
+def missing_fields(data):
+    """Return the required incident fields that are absent, blank or not strings"""
+    return [
         k
         for k in ("title", "description", "reported_by", "severity")
-        if not data.get(k) or not data.get(k).strip()
+        if not isinstance(data.get(k), str) or not data.get(k).strip()
     ]
+
+
+def validate_fields(data):
+    """Check to see that all fields required to create an incident exist"""
+    if not data:
+        return error_response(ERR_NO_JSON, 400)
+
+    missing = missing_fields(data)
     if missing:
         return jsonify({"error": "Missing required field(s)", "missing": missing}), 400
 
-    valid_severity = [severity.value for severity in Severity]
-    if data["severity"] not in valid_severity:
-        return (
-            jsonify(
-                {
-                    "error": "Invalid severity",
-                    "message": f"Severity must be {valid_severity}",
-                }
-            ),
-            400,
-        )
+    if data["severity"] not in VALID_SEVERITY:
+        return error_response(ERR_INVALID_SEVERITY, 400)
     return None
 
 
@@ -101,7 +310,7 @@ def create_incident():
     """Create a new incident"""
     data = request.get_json()
     err = validate_fields(data)
-    if err:
+    if err is not None:
         return err
 
     incident = Incident(
@@ -113,82 +322,158 @@ def create_incident():
 
     db.session.add(incident)
     db.session.commit()
+    invalidate_response_cache()
 
     return jsonify(incident.to_dict()), 201
 
 
+@app.route("/incidents/batch", methods=["POST"])
+def create_incidents_batch():
+    """Create several incidents in a single transaction"""
+    data = request.get_json()
+    if not data or not isinstance(data, list):
+        return error_response(ERR_NOT_A_BATCH, 400)
+
+    if len(data) > MAX_BATCH_SIZE:
+        return error_response(ERR_BATCH_TOO_LARGE, 400)
+
+    for index, item in enumerate(data):
+        if not isinstance(item, dict):
+            error = {"error": "Incident must be a JSON object"}
+        elif missing := missing_fields(item):
+            error = {"error": "Missing required field(s)", "missing": missing}
+        elif item["severity"] not in VALID_SEVERITY:
+            error = {"error": "Invalid severity", "message": SEVERITY_MESSAGE}
+        else:
+            continue
+        return jsonify({**error, "index": index}), 400
+
+    rows = [
+        {
+            "title": item["title"],
+            "description": item["description"],
+            "reported_by": item["reported_by"],
+            "severity": item["severity"],
+        }
+        for item in data
+    ]
+    db.session.execute(sa.insert(Incident), rows)
+    db.session.commit()
+    invalidate_response_cache()
+
+    return (
+        jsonify({"message": "Incidents created successfully", "created": len(rows)}),
+        201,
+    )
+
+
 @app.route("/incidents", methods=["GET"])
 def get_incidents():
-    """Return a list of all incidents, filtered if filters passed"""
-    incidents = Incident.query
-
+    """Return a page of incidents, filtered if filters passed"""
     status_filter = request.args.get("status")
     severity_filter = request.args.get("severity")
+    limit = request.args.get("limit", MAX_PAGE_SIZE, type=int)
+    offset = request.args.get("offset", 0, type=int)
+    limit = max(0, min(limit, MAX_PAGE_SIZE))
+    offset = max(0, min(offset, MAX_SQLITE_INTEGER))
+    compact = request.args.get("compact", "").lower() in ("1", "true")
+
+    key = (_cache_generation, status_filter, severity_filter, limit, offset, compact)
+    now = time.monotonic()
+    cached = _response_cache.get(key)
+    if cached is not None and now - cached[0] < RESPONSE_CACHE_TTL:
+        return Response(cached[1], status=200, mimetype="application/json")
+
+    page_stmt, count_stmt = LISTINGS[(bool(status_filter) << 1) | bool(severity_filter)]
+    params = {
+        "status": status_filter,
+        "severity": severity_filter,
+        "limit": limit,
+        "offset": offset,
+    }
+
+    total = db.session.execute(count_stmt, params).scalar_one()
+    # Encode rows as they are fetched so only the JSON bytes are held, never a
+    # list of row dicts alongside them
+    rows = db.session.execute(
+        page_stmt, params, execution_options={"yield_per": FETCH_BATCH_SIZE}
+    )
+    body = bytearray(COMPACT_LISTING_PREFIX if compact else LISTING_PREFIX)
+    for i, r in enumerate(rows):
+        if i:
+            body += b","
+        if compact:
+            body += app.json.dumpb(tuple(r))
+        else:
+            body += app.json.dumpb(
+                {
+                    "id": r[0],
+                    "title": r[1],
+                    "description": r[2],
+                    "reported_by": r[3],
+                    "severity": r[4],
+                    "timestamp": r[5],
+                    "status": r[6],
+                }
+            )
+    body += b'],"total":' + str(total).encode() + b"}"
+    body = bytes(body)
 
-    if status_filter:
-        incidents = incidents.filter(Incident.status == status_filter)
-    if severity_filter:
-        incidents = incidents.filter(Incident.severity == severity_filter)
-
-    incidents = incidents.order_by(Incident.timestamp.desc()).all()
-    incident_list = [incident.to_dict() for incident in incidents]
-
-    return jsonify({"incidents": incident_list, "total": len(incident_list)}), 200
+    with _cache_lock:
+        if len(_response_cache) >= RESPONSE_CACHE_MAX_ENTRIES:
+            _response_cache.clear()
+        _response_cache[key] = (now, body)
+    return Response(body, status=200, mimetype="application/json")
 
 
-@app.route("/incidents/<incident_id>", methods=["PATCH"])
+@app.route("/incidents/<int(max=9223372036854775807):incident_id>", methods=["PATCH"])
 def update_incident(incident_id):
     """Update an incident status"""
     incident = db.session.get(Incident, incident_id)
 
     if not incident:
-        return jsonify({"error": "Incident not found"}), 404
+        return error_response(ERR_NOT_FOUND, 404)
 
     data = request.get_json()
     if not data:
-        return jsonify({"error": "No JSON data provided"}), 400
+        return error_response(ERR_NO_JSON, 400)
+    if not isinstance(data, dict):
+        return error_response(ERR_NOT_AN_OBJECT, 400)
 
-    valid_statuses = [status.value for status in Status]
-    if "status" in data and data["status"] not in valid_statuses:
-        return (
-            jsonify(
-                {
-                    "error": "Invalid status",
-                    "message": f"Status must be {valid_statuses}",
-                }
-            ),
-            400,
-        )
+    status = data.get("status")
+    if "status" in data and (not isinstance(status, str) or status not in VALID_STATUS):
+        return error_response(ERR_INVALID_STATUS, 400)
 
     if "status" in data:
-        incident.status = data["status"]
+        incident.status = status
 
     db.session.commit()
+    invalidate_response_cache()
     return (jsonify(incident.to_dict())), 200
 
 
-@app.route("/incidents/<incident_id>", methods=["DELETE"])
+@app.route("/incidents/<int(max=9223372036854775807):incident_id>", methods=["DELETE"])
 def delete_incident(incident_id):
     """Delete an incident"""
     incident = db.session.get(Incident, incident_id)
 
     if not incident:
-        return (jsonify({"error": "Incident not found"})), 404
+        return error_response(ERR_NOT_FOUND, 404)
 
     incident_dict = incident.to_dict()
     db.session.delete(incident)
     db.session.commit()
-    return (
-        jsonify(
-            {
-                "message": "Incident deleted successfully",
-                "deleted_incident": incident_dict,
-            }
-        ),
-        200,
+    invalidate_response_cache()
+    body = (
+        b'{"message":"Incident deleted successfully","deleted_incident":'
+        + app.json.dumpb(incident_dict)
+        + b"}"
     )
+    return Response(body, status=200, mimetype="application/json")
 
 
-# Initialize database
-with app.app_context():
+@app.cli.command("init-db")
+def init_db():
+    """Create the database tables and indexes"""
     db.create_all()
+    click.echo("Initialized the database.")
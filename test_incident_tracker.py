@@ -1,7 +1,14 @@
 """Api tests for incident tracker"""
 
 import pytest
-from incident_tracker import app, db, Incident, Severity
+from incident_tracker import (
+    MAX_BATCH_SIZE,
+    app,
+    db,
+    Incident,
+    Severity,
+    invalidate_response_cache,
+)
 
 
 @pytest.fixture()
@@ -14,6 +21,7 @@ def client():
         with app.app_context():
             db.drop_all()
             db.create_all()
+            invalidate_response_cache()
             yield test_client
 
 
@@ -80,6 +88,107 @@ def test_create_incident_invalid_severity(client):
         assert Incident.query.count() == 0
 
 
+def test_create_incidents_batch(client):
+    """Test creating several incidents in one request"""
+
+    data = [
+        {
+            "title": f"Test incident {i}",
+            "description": "Something broke",
+            "reported_by": "Trent",
+            "severity": Severity.LOW.value,
+        }
+        for i in range(3)
+    ]
+
+    response = client.post("/incidents/batch", json=data)
+
+    assert response.status_code == 201
+    assert response.get_json()["created"] == 3
+
+    with app.app_context():
+        assert Incident.query.count() == 3
+        assert all(incident.status == "Open" for incident in Incident.query.all())
+
+
+def test_create_incidents_batch_invalid_item(client):
+    """Test a batch with one invalid incident creates nothing"""
+
+    data = [
+        {
+            "title": "Test incident",
+            "description": "Something broke",
+            "reported_by": "Trent",
+            "severity": Severity.LOW.value,
+        },
+        {
+            "title": "Test incident",
+            "description": "Something broke",
+            "reported_by": "Trent",
+            "severity": "important",
+        },
+    ]
+
+    response = client.post("/incidents/batch", json=data)
+
+    assert response.status_code == 400
+    result = response.get_json()
+    assert result["error"] == "Invalid severity"
+    assert result["index"] == 1
+
+    with app.app_context():
+        assert Incident.query.count() == 0
+
+
+def test_create_incidents_batch_non_string_field(client):
+    """Test a batch item with a non-string field is rejected with its index"""
+
+    data = [
+        {
+            "title": "Test incident",
+            "description": "Something broke",
+            "reported_by": "Trent",
+            "severity": Severity.LOW.value,
+        },
+        {
+            "title": 1,
+            "description": "Something broke",
+            "reported_by": "Trent",
+            "severity": ["x"],
+        },
+    ]
+
+    response = client.post("/incidents/batch", json=data)
+
+    assert response.status_code == 400
+    result = response.get_json()
+    assert result["error"] == "Missing required field(s)"
+    assert result["missing"] == ["title", "severity"]
+    assert result["index"] == 1
+
+    with app.app_context():
+        assert Incident.query.count() == 0
+
+
+def test_create_incidents_batch_too_large(client):
+    """Test a batch over the size limit is rejected"""
+
+    item = {
+        "title": "Test incident",
+        "description": "Something broke",
+        "reported_by": "Trent",
+        "severity": Severity.LOW.value,
+    }
+
+    response = client.post("/incidents/batch", json=[item] * (MAX_BATCH_SIZE + 1))
+
+    assert response.status_code == 400
+    assert response.get_json()["error"] == "Batch too large"
+
+    with app.app_context():
+        assert Incident.query.count() == 0
+
+
 # Testing GET
 def test_get_incidents(client):
     """Test retrieving incidents with filter for status and severity"""
@@ -125,6 +234,121 @@ def test_get_incidents(client):
     assert result_2["total"] == 2
 
 
+def test_get_incidents_pagination(client):
+    """Test limit and offset page through incidents while total counts them all"""
+
+    for i in range(3):
+        data = {
+            "title": f"Test incident {i}",
+            "description": "Something broke",
+            "reported_by": "Trent",
+            "severity": Severity.MEDIUM.value,
+        }
+        client.post("/incidents", json=data)
+
+    response_1 = client.get("/incidents?limit=2")
+    result_1 = response_1.get_json()
+    assert result_1["total"] == 3
+    assert len(result_1["incidents"]) == 2
+
+    response_2 = client.get("/incidents?limit=2&offset=2")
+    result_2 = response_2.get_json()
+    assert result_2["total"] == 3
+    assert len(result_2["incidents"]) == 1
+
+    page_ids = [incident["id"] for incident in result_1["incidents"]]
+    assert result_2["incidents"][0]["id"] not in page_ids
+
+
+def test_get_incidents_oversized_offset(client):
+    """Test an offset past SQLite's INTEGER range returns an empty page"""
+
+    data = {
+        "title": "Test incident 1",
+        "description": "Something broke",
+        "reported_by": "Trent",
+        "severity": Severity.LOW.value,
+    }
+    client.post("/incidents", json=data)
+
+    response = client.get("/incidents?offset=99999999999999999999")
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result["total"] == 1
+    assert result["incidents"] == []
+
+
+def test_get_incidents_compact(client):
+    """Test compact listings return a header row and one array per incident"""
+
+    data = {
+        "title": "Test incident 1",
+        "description": "Something broke",
+        "reported_by": "Trent",
+        "severity": Severity.HIGH.value,
+    }
+    created = client.post("/incidents", json=data).get_json()
+
+    response = client.get("/incidents?compact=1")
+    result = response.get_json()
+    assert result["total"] == 1
+    assert dict(zip(result["columns"], result["incidents"][0])) == created
+
+
+def test_get_incidents_unknown_filter(client):
+    """Test filtering on a status that doesn't exist returns no incidents"""
+
+    data = {
+        "title": "Test incident 1",
+        "description": "Something broke",
+        "reported_by": "Trent",
+        "severity": Severity.LOW.value,
+    }
+    client.post("/incidents", json=data)
+
+    response = client.get("/incidents?status=Closed")
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result["total"] == 0
+    assert result["incidents"] == []
+
+
+def test_get_incidents_sees_new_incident(client):
+    """Test a cached listing is invalidated when an incident is created"""
+
+    data = {
+        "title": "Test incident 1",
+        "description": "Something broke",
+        "reported_by": "Trent",
+        "severity": Severity.HIGH.value,
+    }
+    client.post("/incidents", json=data)
+    assert client.get("/incidents").get_json()["total"] == 1
+
+    client.post("/incidents", json=data)
+    assert client.get("/incidents").get_json()["total"] == 2
+
+
+def test_get_incidents_sees_update_and_delete(client):
+    """Test a cached listing is invalidated by a status update and a delete"""
+
+    data = {
+        "title": "Test incident 1",
+        "description": "Something broke",
+        "reported_by": "Trent",
+        "severity": Severity.HIGH.value,
+    }
+    incident_id = client.post("/incidents", json=data).get_json()["id"]
+
+    assert client.get("/incidents?status=Resolved").get_json()["total"] == 0
+    client.patch(f"/incidents/{incident_id}", json={"status": "Resolved"})
+    assert client.get("/incidents?status=Resolved").get_json()["total"] == 1
+
+    assert client.get("/incidents").get_json()["total"] == 1
+    client.delete(f"/incidents/{incident_id}")
+    assert client.get("/incidents").get_json()["total"] == 0
+
+
 # Testing PATCH
 def test_update_incident_with_valid_status(client):
     """Test status update for an incident with a valid status"""
@@ -170,6 +394,25 @@ def test_update_incident_with_invalid_status(client):
     assert updated_result["error"] == "Invalid status"
 
 
+def test_update_incident_with_non_object_body(client):
+    """Test status update with a JSON body that isn't an object fails"""
+
+    data = {
+        "title": "Test incident 1",
+        "description": "Something broke",
+        "reported_by": "Trent",
+        "severity": Severity.MEDIUM.value,
+    }
+
+    response = client.post("/incidents", json=data)
+    incident_id = response.get_json()["id"]
+
+    for body in (["x"], "abc", 5):
+        updated_response = client.patch(f"/incidents/{incident_id}", json=body)
+        assert updated_response.status_code == 400
+        assert updated_response.get_json()["error"] == "Expected a JSON object"
+
+
 def test_update_nonexistent_incident(client):
     """ "Test updating an incident that doesn't exist"""
     fake_id = "1"
@@ -181,6 +424,19 @@ def test_update_nonexistent_incident(client):
     assert result["error"] == "Incident not found"
 
 
+def test_update_incident_non_integer_id(client):
+    """Test a non-integer incident id is rejected at routing time"""
+    response = client.patch("/incidents/foo", json={"status": "Resolved"})
+    assert response.status_code == 404
+
+    # Larger than SQLite's INTEGER range
+    oversized_id = "99999999999999999999"
+    response = client.patch(f"/incidents/{oversized_id}", json={"status": "Resolved"})
+    assert response.status_code == 404
+    response = client.delete(f"/incidents/{oversized_id}")
+    assert response.status_code == 404
+
+
 # Testing DELETE
 def test_delete_incident(client):
     """Test deleting an incident"""
@@ -215,3 +471,16 @@ def test_delete_incident(client):
     with app.app_context():
         assert Incident.query.count() == 1
     assert deletion_result["message"] == "Incident deleted successfully"
+    assert deletion_result["deleted_incident"] == result
+
+
+# Testing CLI
+def test_init_db_command(client):
+    """Test the init-db command creates the incidents table"""
+    db.drop_all()
+
+    result = app.test_cli_runner().invoke(args=["init-db"])
+
+    assert result.exit_code == 0
+    assert "Initialized the database." in result.output
+    assert Incident.query.count() == 0